@@ -1,9 +1,61 @@
 import sqlite3
 import csv
-import pandas as pd # Importato per leggere il CSV in modo più robusto
+import pyarrow as pa # Backend Arrow per colonne di stringhe compatte e veloci
+import pyarrow.csv as pv
 import os
+from functools import lru_cache
 
-def create_database_with_image_paths(csv_file_path, output_image_folder="stylized_maps", db_name='geo_game_data.db', table_name='country_info'):
+try:
+    # Driver ADBC per SQLite: inserisce direttamente i buffer Arrow, senza oggetti Python
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+except ImportError:
+    adbc_sqlite = None # Si usa il percorso sqlite3 executemany
+
+# Dimensione (in byte) dei blocchi letti dal CSV: la memoria usata resta costante
+# qualunque sia la dimensione del file (~16 MiB, decine di migliaia di righe)
+_CSV_BLOCK_SIZE = 16 << 20
+
+@lru_cache(maxsize=None)
+def _get_conn(db_name):
+    """
+    Restituisce una connessione SQLite condivisa per db_name, aperta una sola volta,
+    per i chiamanti che accedono ripetutamente allo stesso database.
+    Chi la chiude deve chiamare anche _get_conn.cache_clear().
+    """
+    return sqlite3.connect(db_name)
+
+def _migrate_image_path_column(cursor, table_name, create_table_sql, column_names):
+    """
+    Se la tabella esiste già ma 'image_path' non è una colonna generata (schema
+    precedente, con il percorso salvato come TEXT), la ricrea con lo schema attuale
+    copiando i dati esistenti: altrimenti CREATE TABLE IF NOT EXISTS la lascerebbe
+    invariata e le nuove righe avrebbero image_path NULL.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursore su una connessione in autocommit (isolation_level=None).
+        table_name (str): Nome della tabella.
+        create_table_sql (str): Istruzione CREATE TABLE con lo schema attuale.
+        column_names (list): Colonne dati (escluso image_path) da copiare dalla tabella esistente.
+    """
+    # table_xinfo: l'ultimo campo ('hidden') vale 2 o 3 per le colonne generate VIRTUAL/STORED
+    existing_columns = {row[1]: row[6] for row in cursor.execute(f"PRAGMA table_xinfo({table_name});")}
+    if not existing_columns or existing_columns.get('image_path') in (2, 3):
+        return # Tabella nuova o già con la colonna generata
+
+    copied_columns = ', '.join(col for col in column_names if col in existing_columns)
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_old;")
+        cursor.execute(create_table_sql)
+        cursor.execute(f"INSERT INTO {table_name} ({copied_columns}) SELECT {copied_columns} FROM {table_name}_old;")
+        cursor.execute(f"DROP TABLE {table_name}_old;")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    print(f"Tabella '{table_name}' migrata: 'image_path' è ora una colonna generata.")
+
+def create_database_with_image_paths(csv_file_path, output_image_folder="stylized_maps", db_name='geo_game_data.db', table_name='country_info', fast=False, store_image_path=False, conn=None):
     """
     Crea un database SQLite da un file CSV e aggiunge una colonna per il percorso
     previsto dell'immagine stilizzata di ogni paese.
@@ -13,73 +65,168 @@ def create_database_with_image_paths(csv_file_path, output_image_folder="stylize
         output_image_folder (str): Nome della cartella dove si prevede siano salvate le immagini.
         db_name (str): Nome del file del database SQLite da creare.
         table_name (str): Nome della tabella nel database.
+        fast (bool): Se True disattiva journal su disco e fsync (synchronous=OFF,
+            journal_mode=MEMORY). Adatto solo a un caricamento una tantum, dove il
+            recupero dopo un crash non è importante.
+        store_image_path (bool): Se True la colonna generata 'image_path' è STORED (salvata
+            su disco) invece che VIRTUAL (calcolata da SQLite a ogni lettura).
+        conn (sqlite3.Connection): Connessione già aperta da riutilizzare (ad esempio da
+            _get_conn). Se fornita, db_name serve solo per i messaggi e la connessione
+            non viene chiusa al termine; i PRAGMA modificati vengono ripristinati.
     """
     print(f"--- Creazione del database '{db_name}' e della tabella '{table_name}' ---")
-    conn = None
+    owns_conn = conn is None
+    previous_isolation_level = None
+    previous_pragmas = {}
     try:
-        conn = sqlite3.connect(db_name)
+        if owns_conn:
+            conn = sqlite3.connect(db_name)
+        previous_isolation_level = conn.isolation_level
+        conn.isolation_level = None # Gestiamo le transazioni manualmente (BEGIN/COMMIT espliciti)
         cursor = conn.cursor()
 
-        # 1. Leggi il CSV con pandas per gestire meglio i nomi delle colonne
+        # PRAGMA ottimizzati per la scrittura: WAL + synchronous=NORMAL evitano
+        # un fsync del journal a ogni commit, cache e tabelle temporanee in memoria.
+        # In modalità 'fast' journal e fsync vengono disattivati del tutto.
+        journal_mode, synchronous = ('MEMORY', 'OFF') if fast else ('WAL', 'NORMAL')
+        write_pragmas = {
+            'journal_mode': journal_mode,
+            'synchronous': synchronous,
+            'temp_store': 'MEMORY',
+            'cache_size': -65536, # ~64 MiB
+            'mmap_size': 268435456, # 256 MiB
+        }
+        if not owns_conn:
+            # Connessione del chiamante: salva i valori attuali per ripristinarli al termine
+            # (alcuni PRAGMA, ad esempio mmap_size su un database in memoria, non restituiscono righe)
+            for name in write_pragmas:
+                row = cursor.execute(f"PRAGMA {name};").fetchone()
+                if row is not None:
+                    previous_pragmas[name] = row[0]
+        cursor.executescript(''.join(f"PRAGMA {name}={value};" for name, value in write_pragmas.items()))
+
+        # 1. Leggi il CSV in streaming, a blocchi, come batch Arrow (buffer colonnari,
+        # nessun oggetto Python per cella): il file non viene mai caricato tutto in memoria.
         # Assumiamo che la prima colonna del CSV sia il nome del paese.
-        # Se il tuo CSV ha un'intestazione, pandas la leggerà automaticamente.
-        # Se non ha intestazione, puoi specificare header=None e poi rinominare le colonne.
-        countries_df = pd.read_csv(csv_file_path) # Legge il CSV, pandas inferisce le intestazioni
+        # Il CSV deve avere un'intestazione: pyarrow la usa per i nomi delle colonne.
+        # I tipi delle colonne vengono dedotti dal primo blocco.
+        # Le celle vuote diventano NULL anche nelle colonne di testo (come con pandas)
+        csv_reader = pv.open_csv(
+            csv_file_path,
+            read_options=pv.ReadOptions(block_size=_CSV_BLOCK_SIZE),
+            convert_options=pv.ConvertOptions(strings_can_be_null=True),
+        )
+        # Sostituisci gli spazi nei nomi colonna
+        schema = pa.schema([field.with_name(field.name.replace(' ', '_')) for field in csv_reader.schema])
+        # Gli errori di lettura dei blocchi successivi al primo (ad esempio un tipo non
+        # coerente) vengono conservati: ADBC li riporterebbe come un errore generico
+        stream_errors = []
+
+        def renamed_batches():
+            try:
+                for batch in csv_reader:
+                    yield pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+            except Exception as e:
+                stream_errors.append(e)
+                raise
+
+        countries_batches = pa.RecordBatchReader.from_batches(schema, renamed_batches())
         
         # Assumiamo che la prima colonna sia il nome del paese. 
         # Puoi modificarlo se il nome del paese è in una colonna specifica.
-        country_name_col = countries_df.columns[0] 
+        country_name_col = schema.names[0] 
 
-        # Aggiungi una nuova colonna per il percorso dell'immagine
-        # Normalizza il nome del paese per costruire il path dell'immagine
-        countries_df['image_path'] = countries_df[country_name_col].apply(
-            lambda name: os.path.join(output_image_folder, 
-                                      f"{name.lower().replace(' ', '_').replace('(', '').replace(')', '').replace('.', '')}.png")
-        )
-        
         # 2. Crea la tabella nel database
-        # Converti i tipi di colonna di pandas in tipi SQLite
+        # Converti i tipi di colonna Arrow in tipi SQLite
         column_definitions = []
-        for col_name, dtype in countries_df.dtypes.items():
-            if dtype == 'int64':
+        for field in schema:
+            if pa.types.is_integer(field.type):
                 sqlite_type = 'INTEGER'
-            elif dtype == 'float64':
+            elif pa.types.is_floating(field.type):
                 sqlite_type = 'REAL'
             else: # Per stringhe, bool, ecc.
                 sqlite_type = 'TEXT'
-            column_definitions.append(f"{col_name.replace(' ', '_')} {sqlite_type}") # Sostituisci spazi nei nomi colonna
+            column_definitions.append(f"{field.name} {sqlite_type}")
+
+        # Aggiungi una colonna generata per il percorso dell'immagine: SQLite normalizza
+        # il nome del paese (minuscolo, spazi -> underscore, senza '(', ')' e '.')
+        # senza alcun lavoro per riga in Python durante il caricamento
+        # os.path.join(cartella, '') aggiunge il separatore solo se manca (come il percorso originale)
+        image_folder_sql = os.path.join(output_image_folder, '').replace("'", "''")
+        slug_sql = f"lower(replace(replace(replace(replace({country_name_col}, ' ', '_'), '(', ''), ')', ''), '.', ''))"
+        column_definitions.append(
+            f"image_path TEXT GENERATED ALWAYS AS ('{image_folder_sql}' || {slug_sql} || '.png') "
+            f"{'STORED' if store_image_path else 'VIRTUAL'}"
+        )
         
         create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)});"
+        _migrate_image_path_column(cursor, table_name, create_table_sql, schema.names)
         cursor.execute(create_table_sql)
         print(f"Tabella '{table_name}' creata o già esistente.")
 
-        # 3. Inserisci i dati dal DataFrame nel database
-        # Converti il DataFrame in una lista di tuple per l'inserimento
-        data_to_insert = [tuple(row) for row in countries_df.values]
-
-        # Prepara la query INSERT dinamica
-        columns = ', '.join([col.replace(' ', '_') for col in countries_df.columns])
-        placeholders = ', '.join(['?' for _ in countries_df.columns])
-        insert_sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders});"
-
-        # Esegui l'inserimento batch
-        cursor.executemany(insert_sql, data_to_insert)
-        conn.commit()
+        # 3. Inserisci i dati nel database, un blocco alla volta, in un'unica transazione
+        # (un solo fsync al commit, qualunque sia il numero di blocchi)
+        # ADBC apre una propria connessione: serve il percorso reale del file del database
+        # 'main' (vuoto per i database in memoria) e nessuna transazione in corso su conn,
+        # altrimenti le due connessioni vedrebbero dati diversi
+        adbc_db_path = None
+        if adbc_sqlite is not None and not conn.in_transaction:
+            adbc_db_path = next((row[2] for row in cursor.execute("PRAGMA database_list;") if row[1] == 'main'), None)
+        if adbc_db_path:
+            # ADBC: i batch Arrow vengono passati al bulk loader di SQLite su una sua connessione.
+            # In autocommit i PRAGMA si possono impostare (non sono ammessi dentro una
+            # transazione); la transazione unica è poi aperta e chiusa esplicitamente.
+            with adbc_sqlite.connect(adbc_db_path, autocommit=True) as adbc_conn:
+                with adbc_conn.cursor() as adbc_cursor:
+                    for name, value in write_pragmas.items():
+                        adbc_cursor.execute(f"PRAGMA {name}={value};")
+                        adbc_cursor.fetchall()
+                    adbc_cursor.execute("BEGIN")
+                    try:
+                        adbc_cursor.adbc_ingest(table_name, countries_batches, mode='append')
+                        adbc_cursor.execute("COMMIT")
+                    except Exception:
+                        # Il cursore di adbc_ingest resta legato ai parametri dell'inserimento
+                        # fallito: il ROLLBACK va eseguito su un cursore nuovo
+                        with adbc_conn.cursor() as rollback_cursor:
+                            rollback_cursor.execute("ROLLBACK")
+                        if stream_errors:
+                            raise stream_errors[0]
+                        raise
+        else:
+            # Senza ADBC (o con un database in memoria, o una transazione già aperta): executemany per ogni
+            # blocco; le tuple Python vengono create solo per il blocco corrente
+            columns = ', '.join(schema.names)
+            placeholders = ', '.join(['?' for _ in schema.names])
+            insert_sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders});"
+            cursor.execute("BEGIN")
+            try:
+                for batch in countries_batches:
+                    cursor.executemany(insert_sql, zip(*(column.to_pylist() for column in batch.columns)))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
         print(f"Dati importati con successo da '{csv_file_path}' in '{db_name}'.")
         print(f"Aggiunta colonna 'image_path' con i percorsi delle immagini.")
 
     except FileNotFoundError:
         print(f"Errore: File CSV non trovato al percorso '{csv_file_path}'")
-    except pd.errors.EmptyDataError:
-        print(f"Errore: Il file CSV '{csv_file_path}' è vuoto.")
+    except pa.ArrowInvalid as e:
+        print(f"Errore: Il file CSV '{csv_file_path}' è vuoto o non valido: {e}")
     except sqlite3.Error as e:
         print(f"Errore del database: {e}")
     except Exception as e:
         print(f"Si è verificato un errore inatteso: {e}")
     finally:
-        if conn:
+        if conn and owns_conn:
             conn.close()
             print("Connessione al database chiusa.")
+        elif conn:
+            # Ripristina la connessione del chiamante
+            if previous_pragmas:
+                conn.executescript(''.join(f"PRAGMA {name}={value};" for name, value in previous_pragmas.items()))
+            conn.isolation_level = previous_isolation_level
 
 # --- Esempio di Utilizzo ---
 if __name__ == "__main__":
@@ -91,15 +238,15 @@ if __name__ == "__main__":
     output_db = 'geo_game_with_images.db'
     image_folder = 'stylized_maps' # La cartella dove salvi le immagini PNG
 
-    # Esegui la funzione per creare il database
-    create_database_with_image_paths(csv_file, image_folder, output_db)
-
-    # Puoi anche verificare il contenuto del database (opzionale)
-    print("\n--- Verifica contenuto database ---")
-    conn_check = None
+    # Esegui la funzione per creare il database e verificane il contenuto
+    # sulla stessa connessione, senza riaprire il file
+    conn = _get_conn(output_db)
     try:
-        conn_check = sqlite3.connect(output_db)
-        cursor_check = conn_check.cursor()
+        create_database_with_image_paths(csv_file, image_folder, output_db, conn=conn)
+
+        # Puoi anche verificare il contenuto del database (opzionale)
+        print("\n--- Verifica contenuto database ---")
+        cursor_check = conn.cursor()
         cursor_check.execute(f"SELECT * FROM country_info LIMIT 5;") # Mostra le prime 5 righe
         rows = cursor_check.fetchall()
         column_names = [description[0] for description in cursor_check.description]
@@ -109,5 +256,21 @@ if __name__ == "__main__":
     except sqlite3.Error as e:
         print(f"Errore durante la verifica del database: {e}")
     finally:
-        if conn_check:
-            conn_check.close()
\ No newline at end of file
+        conn.close()
+        _get_conn.cache_clear()
+
+    # Verifica che il caricamento funzioni anche su una connessione in memoria fornita dal chiamante
+    print("\n--- Verifica caricamento su connessione in memoria ---")
+    memory_conn = sqlite3.connect(':memory:')
+    try:
+        create_database_with_image_paths(csv_file, image_folder, ':memory:', conn=memory_conn)
+        loaded_rows = memory_conn.execute("SELECT COUNT(*) FROM country_info;").fetchone()[0]
+        expected_rows = pv.read_csv(csv_file).num_rows
+        if loaded_rows == expected_rows:
+            print(f"OK: {loaded_rows} righe caricate.")
+        else:
+            print(f"Errore: caricate {loaded_rows} righe invece di {expected_rows}.")
+    except sqlite3.Error as e:
+        print(f"Errore durante la verifica in memoria: {e}")
+    finally:
+        memory_conn.close()
@@ -1,9 +1,89 @@
 import pandas as pd
 import geopandas
-import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps", missing_txt_path="missing.txt"):
+# Caratteri rimossi dai nomi dei paesi per costruire il nome file (regex compilata una sola volta)
+_SLUG_STRIP_RE = re.compile(r'[().]')
+
+# Parametri di rendering: lato maggiore dell'immagine (10 pollici a 300 dpi),
+# margine attorno al paese e spessore del bordo (0.7 pt a 300 dpi)
+_MAP_SIZE_PX = 3000
+_MAP_MARGIN = 0.05
+_OUTLINE_WIDTH_PX = 3
+
+# Immagini a palette (1 byte per pixel invece dei 4 di RGBA: la codifica PNG,
+# che domina il tempo di rendering, lavora su un quarto dei dati)
+_TRANSPARENT, _WHITE, _BLACK = 0, 1, 2
+_PALETTE = [0, 0, 0, 255, 255, 255, 0, 0, 0]
+
+def _render_country(args):
+    """
+    Genera il PNG stilizzato di un singolo paese. Eseguita nei processi worker.
+
+    Il poligono viene rasterizzato direttamente con Pillow (ImageDraw), senza
+    l'infrastruttura Figure/Axes/Renderer di matplotlib.
+
+    Args:
+        args (tuple): (geom_wkb, bounds, is_geographic, simplify_tolerance_px, country_name, output_png_file);
+            la geometria è serializzata in WKB per rendere economico il pickling verso i worker,
+            bounds è la tupla (minx, miny, maxx, maxy) precalcolata nel processo principale,
+            is_geographic indica se il CRS del GeoJSON è geografico (latitudine/longitudine),
+            simplify_tolerance_px è la tolleranza di semplificazione in pixel (0 o None: nessuna).
+
+    Returns:
+        tuple: (country_name, output_png_file, errore) dove errore è None se la mappa è stata generata.
+    """
+    geom_wkb, bounds, is_geographic, simplify_tolerance_px, country_name, output_png_file = args
+    try:
+        geom = shapely.from_wkb(geom_wkb)
+
+        # Area da disegnare: bounds del paese con il 5% di margine per lato
+        minx, miny, maxx, maxy = bounds
+        pad_x, pad_y = (maxx - minx) * _MAP_MARGIN, (maxy - miny) * _MAP_MARGIN
+        minx, maxx, miny, maxy = minx - pad_x, maxx + pad_x, miny - pad_y, maxy + pad_y
+
+        # Come geopandas: solo con un CRS geografico l'asse y viene allungato di
+        # 1/cos(latitudine media), altrimenti le unità dei due assi sono uguali
+        aspect = 1 / np.cos(np.radians((miny + maxy) / 2)) if is_geographic else 1
+        scale = _MAP_SIZE_PX / max(maxx - minx, (maxy - miny) * aspect)
+        width = max(1, round((maxx - minx) * scale))
+        height = max(1, round((maxy - miny) * aspect * scale))
+
+        if simplify_tolerance_px:
+            # Elimina i vertici sotto il pixel: la tolleranza è relativa alla scala di questo
+            # paese (ogni immagine è zoomata su un solo paese, quindi non può essere assoluta)
+            geom = geom.simplify(simplify_tolerance_px / (scale * max(aspect, 1)), preserve_topology=True)
+
+        image = Image.new('P', (width, height), _TRANSPARENT) # Sfondo trasparente
+        image.putpalette(_PALETTE)
+        draw = ImageDraw.Draw(image)
+
+        def to_pixels(ring):
+            # Tutti i vertici dell'anello in un'unica chiamata vettoriale (asse y invertito)
+            coords = shapely.get_coordinates(ring)
+            coords[:, 0] = (coords[:, 0] - minx) * scale
+            coords[:, 1] = (maxy - coords[:, 1]) * aspect * scale
+            return coords.ravel().tolist()
+
+        # Disegna ogni poligono in bianco con bordo nero; i buchi tornano trasparenti
+        for polygon in shapely.get_parts(geom):
+            draw.polygon(to_pixels(polygon.exterior), fill=_WHITE, outline=_BLACK, width=_OUTLINE_WIDTH_PX)
+            for interior in polygon.interiors:
+                draw.polygon(to_pixels(interior), fill=_TRANSPARENT, outline=_BLACK, width=_OUTLINE_WIDTH_PX)
+
+        image.save(output_png_file, transparency=_TRANSPARENT)
+        return country_name, output_png_file, None
+    except Exception as e:
+        # L'eccezione viene restituita al processo principale, che distingue
+        # gli errori di I/O (OSError) da quelli di geometria/rendering
+        return country_name, output_png_file, e
+
+def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps", missing_txt_path="missing.txt", max_workers=None, simplify_tolerance_px=1, force=False):
     """
     Genera mappe stilizzate bianche in PNG per i paesi elencati in un CSV,
     utilizzando i dati di un GeoJSON. Traccia i paesi per cui non è possibile generare una mappa.
@@ -13,6 +93,10 @@ def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps"
         geojson_path (str): Percorso al file GeoJSON contenente la geometria dei paesi.
         output_folder (str): Nome della cartella dove salvare le immagini PNG generate.
         missing_txt_path (str): Nome del file di testo per elencare i paesi mancanti.
+        max_workers (int): Numero di processi per il rendering in parallelo (default: os.cpu_count()).
+        simplify_tolerance_px (float): Tolleranza, in pixel dell'immagine generata, per semplificare
+            i poligoni prima del rendering; 1 pixel è invisibile. 0 o None per disattivare.
+        force (bool): Se True rigenera anche le mappe il cui PNG esiste già.
     """
     
     print(f"Inizio generazione mappe stilizzate...")
@@ -27,9 +111,11 @@ def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps"
 
     try:
         # 1. Leggi i nomi dei paesi dal file CSV
-        # Assumiamo che la prima colonna contenga i nomi dei paesi
-        countries_df = pd.read_csv(csv_path, header=None) # header=None se il CSV non ha intestazione
+        # Assumiamo che la prima colonna contenga i nomi dei paesi:
+        # leggiamo solo quella (usecols), come stringhe, senza inferenza dei tipi
+        countries_df = pd.read_csv(csv_path, header=None, usecols=[0], dtype=str, engine='pyarrow') # header=None se il CSV non ha intestazione
         country_names = countries_df.iloc[:, 0].astype(str).tolist() # Prende la prima colonna
+        country_names = list(dict.fromkeys(country_names)) # Rimuovi i duplicati mantenendo l'ordine
         print(f"Letti {len(country_names)} nomi di paesi da '{csv_path}'")
 
     except FileNotFoundError:
@@ -41,7 +127,12 @@ def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps"
 
     try:
         # 2. Carica il file GeoJSON
-        world = geopandas.read_file(geojson_path)
+        # Engine pyogrio: lettura tramite il driver GDAL in C direttamente in buffer Arrow;
+        # carichiamo solo la colonna 'name' (oltre alla geometria)
+        world = geopandas.read_file(geojson_path, engine='pyogrio', columns=['name'], use_arrow=True)
+        # Indicizza per nome in minuscolo: ogni ricerca diventa un accesso hash O(1)
+        # invece di una scansione completa del GeoDataFrame per ogni paese
+        world = world.assign(_key=world['name'].str.lower()).set_index('_key', drop=False)
         print(f"Caricato file GeoJSON da '{geojson_path}'")
     except FileNotFoundError:
         print(f"Errore: File GeoJSON non trovato al percorso '{geojson_path}'")
@@ -50,49 +141,74 @@ def generate_stylized_maps(csv_path, geojson_path, output_folder="stylized_maps"
         print(f"Errore durante il caricamento del GeoJSON: {e}")
         return
 
-    # Itera sui nomi dei paesi letti dal CSV
-    for country_name in country_names:
-        # Pulisci il nome del paese per usarlo nel nome del file
-        # Sostituisci spazi e caratteri speciali con underscore e converti in minuscolo
-        safe_country_name = country_name.lower().replace(" ", "_").replace("(", "").replace(")", "").replace(".", "")
-
+    # Converti in minuscolo tutti i nomi una sola volta: servono sia come chiavi
+    # di ricerca nel GeoJSON (case-insensitive) sia per costruire il nome del file
+    lower_names = pd.Series(country_names, dtype=str).str.lower()
+    country_keys = lower_names.tolist()
+
+    # Pulisci i nomi dei paesi per usarli nel nome del file (una sola passata vettoriale,
+    # stessa normalizzazione usata in creation_database.py per la colonna image_path)
+    safe_country_names = (lower_names
+                          .str.replace(_SLUG_STRIP_RE, '', regex=True)
+                          .str.replace(' ', '_', regex=False)
+                          .tolist())
+
+    # Salta i paesi il cui PNG esiste già (a meno di force=True): le esecuzioni
+    # successive rigenerano solo le mappe nuove
+    # Anche i nomi che differiscono solo per maiuscole/minuscole producono lo stesso
+    # file: ne generiamo uno solo, evitando che due worker scrivano lo stesso PNG
+    pending_countries = []
+    pending_files = set()
+    skipped_count = 0
+    for country_name, key, safe_country_name in zip(country_names, country_keys, safe_country_names):
         output_png_file = os.path.join(output_folder, f"{safe_country_name}.png")
+        if output_png_file in pending_files or (not force and os.path.exists(output_png_file)):
+            skipped_count += 1
+            continue
+        pending_files.add(output_png_file)
+        pending_countries.append((country_name, key, output_png_file))
+    if skipped_count:
+        print(f"Saltati {skipped_count} paesi con mappa già esistente o duplicata (usa force=True per rigenerare le esistenti).")
+
+    # Cerca i paesi nel GeoJSON (case-insensitive) con un'unica intersezione sull'indice:
+    # l'indice contiene i valori della colonna 'name' in minuscolo.
+    # Adatta 'name' se il tuo GeoJSON usa una colonna diversa per i nomi dei paesi
+    # Poi serializza in WKB e calcola i bounds di tutte le geometrie con una sola chiamata ciascuno
+    # Più feature con lo stesso nome (in minuscolo) vengono unite in un'unica geometria,
+    # altrimenti resterebbe solo l'ultima
+    matches = world.loc[world.index.intersection([key for _, key, _ in pending_countries])].geometry
+    if not matches.index.is_unique:
+        matches = matches.groupby(level=0).agg(shapely.union_all)
+    match_wkb = dict(zip(matches.index, shapely.to_wkb(matches.values)))
+    match_bounds = dict(zip(matches.index, map(tuple, shapely.bounds(matches.values))))
+
+    # I paesi non trovati vanno nella lista dei mancanti
+    for country_name, key, _ in pending_countries:
+        if key not in match_wkb:
+            print(f"Paese '{country_name}' non trovato nel GeoJSON.")
+            missing_countries.append(country_name)
 
-        # Cerca il paese nel GeoJSON (case-insensitive)
-        # Assumiamo che il nome del paese sia nella colonna 'name' o 'NAME'
-        # Adatta 'name' se il tuo GeoJSON usa una colonna diversa per i nomi dei paesi
-        found_country = world[world['name'].str.lower() == country_name.lower()]
-
-        if not found_country.empty:
-            # Se il paese è stato trovato, genera la mappa
-            try:
-                fig, ax = plt.subplots(1, 1, figsize=(10, 10)) # Dimensione immagine
-                
-                # Plotta il paese in bianco con bordo nero
-                found_country.plot(ax=ax, color='white', edgecolor='black', linewidth=0.7)
-
-                ax.set_title(f'Map of {country_name}', fontsize=0) # Titolo invisibile
-                ax.set_axis_off() # Nascondi gli assi per una mappa pulita
+    # I paesi trovati diventano task indipendenti per il rendering in parallelo
+    is_geographic = world.crs is not None and world.crs.is_geographic
+    tasks = [(match_wkb[key], match_bounds[key], is_geographic, simplify_tolerance_px, country_name, output_png_file)
+             for country_name, key, output_png_file in pending_countries if key in match_wkb]
 
-                plt.savefig(output_png_file, dpi=300, bbox_inches='tight', pad_inches=0.1, transparent=True)
-                plt.close(fig) # Chiudi il plot per liberare memoria
+    # Ogni mappa è indipendente e CPU-bound: distribuiscile su più processi
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for country_name, output_png_file, error in executor.map(_render_country, tasks, chunksize=8):
+            if error is None:
                 print(f"Generata mappa per '{country_name}' -> '{output_png_file}'")
-            except Exception as e:
-                print(f"Errore durante la generazione della mappa per '{country_name}': {e}")
+            elif isinstance(error, OSError):
+                print(f"Errore durante il salvataggio della mappa per '{country_name}' in '{output_png_file}': {error}")
                 missing_countries.append(country_name)
-            except Exception as e:
-                print(f"Errore durante la generazione della mappa per '{country_name}': {e}")
+            else:
+                print(f"Errore durante la generazione della mappa per '{country_name}': {error}")
                 missing_countries.append(country_name)
-        else:
-            # Se il paese non è stato trovato, aggiungilo alla lista dei mancanti
-            print(f"Paese '{country_name}' non trovato nel GeoJSON.")
-            missing_countries.append(country_name)
 
     # Scrivi la lista dei paesi mancanti nel file missing.txt
     if missing_countries:
         with open(missing_txt_path, 'w', encoding='utf-8') as f:
-            for country in missing_countries:
-                f.write(f"{country}\n")
+            f.write('\n'.join(missing_countries) + '\n') # Un'unica scrittura per tutta la lista
         print(f"\nGenerato '{missing_txt_path}' con {len(missing_countries)} paesi mancanti.")
     else:
         print("\nNessun paese mancante rilevato.")